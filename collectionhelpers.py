@@ -1,23 +1,174 @@
 """Decorator helpers for defining custom Sequence and Mapping types
 with fancy indexing behavior like the builtins"""
 
-from collections.abc import Sequence, MutableSequence, Mapping
-from functools import wraps
+from bisect import bisect_right
+from collections.abc import Sequence, MutableSequence
+from collections.abc import Mapping, MutableMapping, ItemsView, ValuesView
+from contextlib import contextmanager
+from functools import partial, wraps
+from itertools import accumulate
+from math import ceil, log
+import os
+import sys
+import weakref
 
-def mapping_helper(cls):
+_MASK64 = (1 << 64) - 1
+
+def _mix64(h):
+    # The splitmix64 finalizer. Small ints hash to themselves, so we
+    # can't just use hash values directly as bit indices.
+    h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return h ^ (h >> 31)
+
+class _BloomFilter:
+    """A set of hashes that can say a key is definitely absent.
+
+    A key that was added is always reported as present; a key that
+    wasn't is reported as present with probability around error_rate,
+    as long as no more than capacity keys have been added."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.nbits = max(64, ceil(-capacity * log(error_rate) / log(2)**2))
+        self.nhashes = max(1, round(self.nbits / capacity * log(2)))
+        self.bits = bytearray((self.nbits + 7) // 8)
+        # Number of adds that set at least one new bit (which is every
+        # add of a new key, except for the ones that were already false
+        # positives).
+        self.count = 0
+
+    def _indices(self, key):
+        h1 = _mix64(hash(key) & _MASK64)
+        h2 = _mix64(h1) | 1
+        nbits = self.nbits
+        return ((h1 + i*h2) % nbits for i in range(self.nhashes))
+
+    def add(self, key):
+        try:
+            indices = self._indices(key)
+        except TypeError:
+            # Unhashable keys always look like they might be present.
+            return
+        bits = self.bits
+        new = False
+        for i in indices:
+            byte, bit = divmod(i, 8)
+            if not bits[byte] & (1 << bit):
+                bits[byte] |= 1 << bit
+                new = True
+        self.count += new
+
+    def __contains__(self, key):
+        try:
+            indices = self._indices(key)
+        except TypeError:
+            return True
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in indices)
+
+# Maps each mapping_helper __getitem__ wrapper to the raw __getitem__ it
+# wraps, so the views and __eq__ can find the right raw __getitem__ for
+# any subclass (one that overrides __getitem__, with or without being
+# decorated again, shouldn't get its base class's).
+_getitem_wrappers = {}
+
+def _raw_getitem(mapping):
+    getitem = type(mapping).__getitem__
+    return _getitem_wrappers.get(getitem, getitem)
+
+# The key filters of mapping_helper instances, keyed by id(mapping). They
+# live here rather than on the instances so they never get pickled or
+# copied along with them: their bits come from hash(), which (for str,
+# bytes, etc.) is salted differently in every interpreter, so a filter
+# carried into another process would say present keys were absent.
+_key_filters = {}
+
+def reset_key_filter(mapping):
+    """Throw away mapping's key filter, so the next lookup rebuilds it.
+
+    This is only needed if the mapping's storage was changed other than
+    through its __setitem__."""
+    _key_filters.pop(id(mapping), None)
+
+def mapping_helper(cls=None, *, key_filter_error_rate=None,
+                   key_filter_headroom=2):
     """Class decorator that adds missing-key handling.
 
     Define a __getitem__ that raises KeyError on missing keys, add the
     decorator, and it's replaced with a wrapper that calls __missing__
-    on missing keys, exactly as dict does."""
+    on missing keys, exactly as dict does.
+
+    If key_filter_error_rate is given, each instance also keeps a Bloom
+    filter of its keys (built from __iter__ on the first lookup, and
+    updated by __setitem__), so most lookups of absent keys can skip
+    __getitem__ entirely. The error rate is the fraction of absent keys
+    that still have to be looked up; lower rates use more memory. The
+    filter is sized for key_filter_headroom times as many keys as the
+    mapping has when it's built, and rebuilt when more keys than that
+    have been added; more headroom means fewer rebuilds, but more memory.
+
+    The filter assumes a lookup key hashes and compares equal to the key
+    __iter__ yields for it. If the mapping normalizes keys (e.g., case-
+    insensitively), it has to define a _normalize_key method that does
+    the same normalization, or it will get wrong answers. Instances also
+    have to be weak-referenceable, because the filters are kept outside
+    of them, and dropped when they die."""
+
+    if cls is None:
+        return partial(mapping_helper,
+                       key_filter_error_rate=key_filter_error_rate,
+                       key_filter_headroom=key_filter_headroom)
 
     if not issubclass(cls, Mapping):
         raise TypeError("can only help mappings")
 
+    filtered = key_filter_error_rate is not None
+    if filtered and not 0 < key_filter_error_rate < 1:
+        raise ValueError("key_filter_error_rate must be between 0 and 1")
+    if filtered and key_filter_headroom < 1:
+        raise ValueError("key_filter_headroom must be at least 1")
+    if filtered and not cls.__weakrefoffset__:
+        raise TypeError("key filters need weak-referenceable instances")
+
+    def filter_key(self, key):
+        try:
+            normalize = type(self)._normalize_key
+        except AttributeError:
+            return key
+        return normalize(self, key)
+
+    def build_filter(self):
+        # Leave room to grow, so we don't have to rebuild (which means
+        # iterating all of the keys again) too often.
+        capacity = max(ceil(key_filter_headroom * len(self)), 64)
+        keyfilter = _BloomFilter(capacity, key_filter_error_rate)
+        for key in self:
+            keyfilter.add(filter_key(self, key))
+        ident = id(self)
+        if ident not in _key_filters:
+            # The id can't be reused until after this runs.
+            weakref.finalize(self, _key_filters.pop, ident, None)
+        _key_filters[ident] = keyfilter
+        return keyfilter
+
+    def maybe_contains(self, key):
+        keyfilter = _key_filters.get(id(self))
+        if keyfilter is None:
+            keyfilter = build_filter(self)
+        else:
+            # Deleted keys stay in the filter until it's rebuilt, so a
+            # rebuild also cleans those out.
+            if keyfilter.count > keyfilter.capacity:
+                keyfilter = build_filter(self)
+        return filter_key(self, key) in keyfilter
+
     _getitem = cls.__getitem__
     @wraps(_getitem)
     def __getitem__(self, key):
         try:
+            if filtered and not maybe_contains(self, key):
+                raise KeyError(key)
             return _getitem(self, key)
         except KeyError:
             try:
@@ -28,6 +179,7 @@ def mapping_helper(cls):
                 return missing(self, key)
             raise
     cls.__getitem__ = __getitem__
+    _getitem_wrappers[__getitem__] = _getitem_wrappers.get(_getitem, _getitem)
 
     # The default Mapping.__contains__ just tests for self[key], which
     # will of course check with __missing__. But it shouldn't.
@@ -53,10 +205,275 @@ def mapping_helper(cls):
             except KeyError:
                 return default
         cls.get = get
-            
+
+    if filtered:
+        _contains = cls.__contains__
+        @wraps(_contains)
+        def __contains__(self, key):
+            return maybe_contains(self, key) and _contains(self, key)
+        cls.__contains__ = __contains__
+
+        _get = cls.get
+        @wraps(_get)
+        def get(self, key, default=None):
+            if not maybe_contains(self, key):
+                return default
+            return _get(self, key, default)
+        cls.get = get
+
+        # There's nothing to do on __delitem__, because a key that's
+        # still in the filter just has to be looked up.
+        if issubclass(cls, MutableMapping):
+            _setitem = cls.__setitem__
+            @wraps(_setitem)
+            def __setitem__(self, key, value):
+                _setitem(self, key, value)
+                keyfilter = _key_filters.get(id(self))
+                if keyfilter is not None:
+                    keyfilter.add(filter_key(self, key))
+            cls.__setitem__ = __setitem__
+
+    # The default item and value views look up each value with self[key],
+    # which goes through our wrapper for every key. (Which also means
+    # ItemsView.__contains__ has the same __missing__ issue as above.) If
+    # the class has an _iter_items hook that can fetch items in bulk, we
+    # use that instead.
+    def iteritems(self):
+        try:
+            bulk = type(self)._iter_items
+        except AttributeError:
+            getitem = _raw_getitem(self)
+            return ((key, getitem(self, key)) for key in self)
+        else:
+            return bulk(self)
+
+    # (Registered virtual subclasses may not have these at all.)
+    _items = getattr(cls, 'items', None)
+    if _items == Mapping.items:
+        class HelpedItemsView(ItemsView):
+            __slots__ = ()
+            def __contains__(self, item):
+                key, value = item
+                try:
+                    v = _raw_getitem(self._mapping)(self._mapping, key)
+                except KeyError:
+                    return False
+                else:
+                    return v is value or v == value
+            def __iter__(self):
+                return iteritems(self._mapping)
+        @wraps(_items)
+        def items(self):
+            return HelpedItemsView(self)
+        cls.items = items
+
+    _values = getattr(cls, 'values', None)
+    if _values == Mapping.values:
+        class HelpedValuesView(ValuesView):
+            __slots__ = ()
+            def __iter__(self):
+                for key, value in iteritems(self._mapping):
+                    yield value
+        @wraps(_values)
+        def values(self):
+            return HelpedValuesView(self)
+        cls.values = values
+
+    # The default __eq__ builds a dict out of each side's items. We can
+    # just compare lengths, then look up each of our items in the other.
+    _eq = cls.__eq__
+    if _eq == Mapping.__eq__:
+        @wraps(_eq)
+        def __eq__(self, other):
+            if not isinstance(other, Mapping):
+                return NotImplemented
+            if len(self) != len(other):
+                return False
+            # Use get rather than other[key], in case other also has a
+            # __missing__ (like a defaultdict).
+            missing = object()
+            for key, value in iteritems(self):
+                v = other.get(key, missing)
+                if v is missing or not (v is value or v == value):
+                    return False
+            return True
+        cls.__eq__ = __eq__
+
     return cls
 
-def sequence_helper(cls):
+# Batches currently open on helped mutable sequences, keyed by id(seq).
+# The key can't be recycled while the batch is open, because the batch
+# holds a reference to the sequence.
+_batches = {}
+
+# The classes helped with batching. Subclasses of them are, too.
+_batching_classes = set()
+
+class _Batch:
+    """Primitive mutations recorded inside a MutableSequence.batch block.
+
+    Operations are kept in order, but adjacent deletes are merged into a
+    single range delete, and inserts (or sets) at consecutive indices
+    into a single insert-many (or set-many), so they can be flushed to
+    the sequence's bulk hooks if it has any."""
+
+    def __init__(self, seq):
+        self.seq = seq
+        self.ops = []
+        # How much longer the sequence will be once ops are flushed.
+        self.delta = 0
+        # Whether a __len__ wrapper is already adding in delta (so any
+        # wrappers it calls, e.g., via super(), don't add it again).
+        self.measuring = False
+
+    def record_delete(self, index):
+        self.delta -= 1
+        if self.ops:
+            op = self.ops[-1]
+            if op[0] == 'del':
+                # Deleting backward (as slice deletion does) extends the
+                # run down; deleting at the same index again extends it up.
+                if index == op[1] - 1:
+                    op[1] = index
+                    return
+                if index == op[1]:
+                    op[2] += 1
+                    return
+        self.ops.append(['del', index, index+1])
+
+    def record_insert(self, index, value):
+        self.delta += 1
+        if self.ops:
+            op = self.ops[-1]
+            if op[0] == 'ins' and index == op[1] + len(op[2]):
+                op[2].append(value)
+                return
+        self.ops.append(['ins', index, [value]])
+
+    def record_set(self, index, value):
+        if self.ops:
+            op = self.ops[-1]
+            if op[0] == 'set' and index == op[1] + len(op[2]):
+                op[2].append(value)
+                return
+        self.ops.append(['set', index, [value]])
+
+    def flush(self):
+        if not self.ops:
+            return
+        ops, self.ops, self.delta = self.ops, [], 0
+        seq = self.seq
+        cls = type(seq)
+        # Take the batch out of play while flushing, so the primitives
+        # and bulk hooks see the real length, and anything done through
+        # the wrapped methods (including the fallbacks below, which go
+        # through them so a subclass's primitives get used) happens
+        # immediately.
+        key = id(seq)
+        del _batches[key]
+        try:
+            for op, start, arg in ops:
+                if op == 'del':
+                    hook = getattr(cls, '_delete_range', None)
+                    if hook is not None:
+                        hook(seq, start, arg)
+                    else:
+                        for i in reversed(range(start, arg)):
+                            del seq[i]
+                elif op == 'ins':
+                    hook = getattr(cls, '_insert_many', None)
+                    if hook is not None:
+                        hook(seq, start, arg)
+                    else:
+                        for i, value in enumerate(arg, start=start):
+                            seq.insert(i, value)
+                else:
+                    hook = getattr(cls, '_set_many', None)
+                    if hook is not None:
+                        hook(seq, start, arg)
+                    else:
+                        for i, value in enumerate(arg, start=start):
+                            seq[i] = value
+        finally:
+            _batches[key] = self
+
+def _batched(_delitem, _insert, _setitem):
+    # Inside a batch, the primitives are recorded instead of called.
+    def delitem(self, index):
+        batch = _batches.get(id(self))
+        if batch is None:
+            _delitem(self, index)
+        else:
+            batch.record_delete(index)
+
+    def insertitem(self, index, value):
+        batch = _batches.get(id(self))
+        if batch is None:
+            _insert(self, index, value)
+        else:
+            batch.record_insert(index, value)
+
+    def setitem(self, index, value):
+        batch = _batches.get(id(self))
+        if batch is None:
+            _setitem(self, index, value)
+        else:
+            batch.record_set(index, value)
+
+    return delitem, insertitem, setitem
+
+def _install_batching(cls):
+    # Any read flushes pending mutations first, so reads always see
+    # earlier writes.
+    _getitem = cls.__getitem__
+    @wraps(_getitem)
+    def __getitem__(self, index):
+        batch = _batches.get(id(self))
+        if batch is not None:
+            batch.flush()
+        return _getitem(self, index)
+    cls.__getitem__ = __getitem__
+
+    # The length has to account for pending inserts and deletes, because
+    # the index checking (and lots of mixin methods) depend on it. But
+    # only once, even if this wraps another helped __len__, or one that
+    # calls super().__len__().
+    _len = cls.__len__
+    @wraps(_len)
+    def __len__(self):
+        batch = _batches.get(id(self))
+        if batch is None or batch.measuring:
+            return _len(self)
+        batch.measuring = True
+        try:
+            return _len(self) + batch.delta
+        finally:
+            batch.measuring = False
+    cls.__len__ = __len__
+
+    # Don't clobber a batch method the class already has (database-backed
+    # classes are exactly the ones likely to have one).
+    if not hasattr(cls, 'batch'):
+        @contextmanager
+        def batch(self):
+            """Context manager that records primitive mutations and flushes
+            them, coalesced, on exit (or before the next read)."""
+            key = id(self)
+            if key in _batches:
+                # Nested batches just join the outer one.
+                yield self
+                return
+            batch = _batches[key] = _Batch(self)
+            try:
+                yield self
+            finally:
+                try:
+                    batch.flush()
+                finally:
+                    del _batches[key]
+        cls.batch = batch
+
+def sequence_helper(cls=None, *, batching=False):
     """Class decorator that adds slice and negative index handling and
     type and range checking.
     
@@ -64,7 +481,16 @@ def sequence_helper(cls):
     and insert methods) that can only handle positive integer indices within 
     range, add the decorator, and your methods will be replaced by wrappers 
     that can handle all the same varieties of indexing as tuple and list,
-    exactly they way they do."""
+    exactly they way they do.
+
+    If batching is true (or a base class was helped with batching), the
+    mutable sequence also gets a batch context manager, which records
+    primitive mutations and flushes them, coalesced, to optional bulk
+    hooks. This costs a little on every __getitem__ and __len__, so it's
+    off by default."""
+
+    if cls is None:
+        return partial(sequence_helper, batching=batching)
 
     if not issubclass(cls, Sequence):
         raise TypeError("can only help sequences")
@@ -100,9 +526,15 @@ def sequence_helper(cls):
         return index
     
     _getitem = cls.__getitem__
+    # A sequence that can slice without copying every element (e.g., by
+    # sharing storage copy-on-write) can provide a _get_slice hook, which
+    # gets the normalized slice as a range.
+    _getslice = getattr(cls, '_get_slice', None)
     @wraps(_getitem)
     def __getitem__(self, index):
         if isinstance(index, slice):
+            if _getslice is not None:
+                return _getslice(self, deslice(self, index))
             # TODO: Maybe this should be a choice between returning a list,
             #       a seq, or a type(self)? Not all sequence types can be
             #       constructed from an iterable...
@@ -112,25 +544,43 @@ def sequence_helper(cls):
     cls.__getitem__ = __getitem__
 
     if not issubclass(cls, MutableSequence):
+        if batching:
+            raise TypeError("can only batch mutable sequences")
         return cls
     
     _delitem = cls.__delitem__
+    _insert = cls.insert
+    _setitem = cls.__setitem__
+
+    # If a base class records into batches, our wrappers have to as well,
+    # or their mutations would jump ahead of the pending ones.
+    if not batching:
+        batching = any(base in _batching_classes for base in cls.__mro__)
+    if batching:
+        _batching_classes.add(cls)
+        _install_batching(cls)
+        delitem, insertitem, setitem = _batched(_delitem, _insert, _setitem)
+    else:
+        delitem, insertitem, setitem = _delitem, _insert, _setitem
+
     @wraps(_delitem)
     def __delitem__(self, index):
         if isinstance(index, slice):
-            for i in reversed(deslice(self, index)):
-                _delitem(self, i)
+            # Delete from the end, so earlier indices stay valid.
+            indices = deslice(self, index)
+            if indices.step > 0:
+                indices = reversed(indices)
+            for i in indices:
+                delitem(self, i)
         else:
-            _delitem(self, posintify(self, index))
+            delitem(self, posintify(self, index))
     cls.__delitem__ = __delitem__
 
-    _insert = cls.insert
     @wraps(_insert)
     def insert(self, index, value):
-        _insert(self, posinttruncify(self, index), value)
+        insertitem(self, posinttruncify(self, index), value)
     cls.insert = insert
 
-    _setitem = cls.__setitem__
     @wraps(_setitem)
     def __setitem__(self, index, value):
         if isinstance(index, slice):
@@ -163,11 +613,294 @@ def sequence_helper(cls):
                 except TypeError:
                     raise TypeError("must assign iterable to slice")
                 for i in reversed(indices):
-                    _delitem(self, i)
+                    delitem(self, i)
                 for i, value in enumerate(values, start=indices.start):
-                    _insert(self, i, value)
+                    insertitem(self, i, value)
         else:
-            _setitem(self, posintify(self, index), value)
+            setitem(self, posintify(self, index), value)
     cls.__setitem__ = __setitem__
 
+    # list has a copy method, but MutableSequence doesn't.
+    if not hasattr(cls, 'copy'):
+        def copy(self):
+            """Return a shallow copy, the same as self[:]."""
+            return self[:]
+        cls.copy = copy
+
     return cls
+
+@sequence_helper
+class CopyOnWriteList(MutableSequence):
+    """A list-like sequence whose slices share storage with it.
+
+    The values are stored in chunks of around chunk_size elements. A
+    simple slice (or a copy) shares every chunk it covers completely,
+    and only copies the partial chunks at its ends. Shared chunks are
+    only copied, one at a time, when either side mutates them, so taking
+    a snapshot to hand off to another thread is cheap, and stays cheap
+    as long as neither side makes many scattered changes."""
+
+    chunk_size = 1024
+
+    def __init__(self, iterable=()):
+        values = list(iterable)
+        n = self.chunk_size
+        chunks = [values[i:i+n] for i in range(0, len(values), n)]
+        self._set_chunks(chunks, [True] * len(chunks))
+
+    def _set_chunks(self, chunks, owned):
+        self._chunks = chunks
+        # A chunk that's shared with another list may be in use by both,
+        # so it has to be copied before it can be mutated.
+        self._owned = owned
+        self._starts = [0, *accumulate(map(len, chunks[:-1]))] if chunks else []
+        self._len = sum(map(len, chunks))
+
+    def _locate(self, index):
+        ci = bisect_right(self._starts, index) - 1
+        return ci, index - self._starts[ci]
+
+    def _own(self, ci):
+        if not self._owned[ci]:
+            self._chunks[ci] = self._chunks[ci][:]
+            self._owned[ci] = True
+        return self._chunks[ci]
+
+    def _shift(self, ci, delta):
+        starts = self._starts
+        for j in range(ci+1, len(starts)):
+            starts[j] += delta
+        self._len += delta
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        ci, off = self._locate(index)
+        return self._chunks[ci][off]
+
+    def __setitem__(self, index, value):
+        ci, off = self._locate(index)
+        self._own(ci)[off] = value
+
+    def __delitem__(self, index):
+        ci, off = self._locate(index)
+        chunk = self._own(ci)
+        del chunk[off]
+        self._shift(ci, -1)
+        if not chunk:
+            del self._chunks[ci], self._owned[ci], self._starts[ci]
+
+    def insert(self, index, value):
+        if not self._chunks:
+            self._set_chunks([[value]], [True])
+            return
+        if index == self._len:
+            ci = len(self._chunks) - 1
+            off = index - self._starts[ci]
+        else:
+            ci, off = self._locate(index)
+        chunk = self._own(ci)
+        chunk.insert(off, value)
+        self._shift(ci, 1)
+        if len(chunk) > 2 * self.chunk_size:
+            half = len(chunk) // 2
+            self._chunks[ci+1:ci+1] = [chunk[half:]]
+            self._owned[ci+1:ci+1] = [True]
+            self._starts[ci+1:ci+1] = [self._starts[ci] + half]
+            del chunk[half:]
+
+    def _get_slice(self, indices):
+        if indices.step != 1:
+            chunks = self._chunks
+            return type(self)(chunks[ci][off]
+                              for ci, off in map(self._locate, indices))
+        new = type(self)()
+        if not indices:
+            return new
+        first, lo = self._locate(indices.start)
+        last, hi = self._locate(indices.stop - 1)
+        chunks, owned = [], []
+        for ci in range(first, last+1):
+            chunk = self._chunks[ci]
+            start = lo if ci == first else 0
+            stop = hi+1 if ci == last else len(chunk)
+            if start == 0 and stop == len(chunk):
+                self._owned[ci] = False
+                chunks.append(chunk)
+                owned.append(False)
+            else:
+                chunks.append(chunk[start:stop])
+                owned.append(True)
+        new._set_chunks(chunks, owned)
+        return new
+
+    # MutableSequence doesn't provide comparison, but a list-like type
+    # should compare equal to copies of itself, and to lists. (This goes
+    # through iteration rather than straight to the chunks, so any
+    # pending batched mutations get flushed first.)
+    __hash__ = None
+
+    def __eq__(self, other):
+        if not isinstance(other, (CopyOnWriteList, list)):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        return all(a is b or a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self)})"
+
+def _map_chunk(func, chunk):
+    return [func(value) for value in chunk]
+
+@contextmanager
+def _attached_shared_memory(name, nbytes):
+    """Attach to the parent's shared memory segment without registering
+    it with a resource tracker, and yield a view of its first nbytes.
+
+    If we registered it, our tracker would try to unlink it (again) at
+    exit, maybe while the parent's still using it. Python 3.13+ can just
+    pass track=False, and Windows doesn't use a tracker at all. But on
+    POSIX before 3.13, SharedMemory always registers, so we open and map
+    the segment ourselves, with the same private _posixshmem module it
+    uses. If that isn't usable, we fall back to attaching and then
+    unregistering. That's fine if this worker has its own tracker, but
+    if it shares the parent's (which keeps a set, not a count), it races
+    with the other workers and the parent."""
+    shm_open = None
+    if sys.version_info < (3, 13) and os.name != 'nt':
+        try:
+            from _posixshmem import shm_open
+        except ImportError:
+            pass
+    if shm_open is not None:
+        import mmap
+        fd = shm_open('/' + name, os.O_RDWR, mode=0o600)
+        try:
+            mapped = mmap.mmap(fd, nbytes)
+        finally:
+            os.close(fd)
+        try:
+            with memoryview(mapped) as buf:
+                yield buf
+        finally:
+            mapped.close()
+        return
+    from multiprocessing.shared_memory import SharedMemory
+    if sys.version_info >= (3, 13):
+        shm = SharedMemory(name=name, track=False)
+    else:
+        shm = SharedMemory(name=name)
+        if os.name != 'nt':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        with shm.buf[:nbytes] as buf:
+            yield buf
+    finally:
+        shm.close()
+
+def _map_shared_chunk(func, name, nbytes, fmt, start, stop):
+    # Every view has to be released before the segment can be closed,
+    # even if func raises (and its traceback holds on to them).
+    with _attached_shared_memory(name, nbytes) as raw, raw.cast(fmt) as view:
+        with view[start:stop] as chunk:
+            return [func(value) for value in chunk]
+
+def parallel_map(func, seq, *, chunk_size=None, executor=None, ordered=True):
+    """Return an iterator over func applied to each element of seq,
+    computed in parallel, a chunk at a time.
+
+    The chunks are taken by slicing seq, so a sequence_helper class with
+    a cheap _get_slice hook (like CopyOnWriteList) gets cheap chunks. If
+    seq's class has a _buffer hook, which returns a one-dimensional
+    buffer (like an array.array or mmap) of the elements, chunks are
+    memoryviews of that buffer instead--or, with a process pool, views
+    of a single shared memory copy of it, instead of pickled chunks.
+
+    The work is done on executor, or on a new thread pool if it's None.
+    Because of the GIL, a thread pool only helps if func spends its time
+    outside of Python bytecode (in I/O, or in C code that releases the
+    GIL). For CPU-heavy pure-Python work, pass a ProcessPoolExecutor,
+    in which case func has to be picklable. If ordered is false,
+    each chunk's results are yielded as soon as they're done, instead of
+    in order."""
+
+    # These are only imported here, because they're slow to import, and
+    # shared memory isn't available on every platform.
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    from concurrent.futures import wait, FIRST_COMPLETED
+
+    n = len(seq)
+    if chunk_size is None:
+        chunk_size = max(1, ceil(n / (4 * (os.cpu_count() or 1))))
+    elif chunk_size < 1:
+        raise ValueError("chunk_size must be positive")
+    starts = range(0, n, chunk_size)
+
+    getbuffer = getattr(type(seq), '_buffer', None)
+
+    def results(executor):
+        # Nothing gets allocated until the iterator is started, so it
+        # can all be cleaned up when it's finished or closed.
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor()
+        processes = isinstance(executor, ProcessPoolExecutor)
+        view = shm = None
+        # Only keep a few chunks per worker in flight at a time, so we
+        # aren't holding a copy of the whole sequence in chunks.
+        window = 2 * (os.cpu_count() or 1)
+        pending = {}
+
+        def submit(start):
+            stop = min(start + chunk_size, n)
+            if shm is not None:
+                return executor.submit(_map_shared_chunk, func, shm.name,
+                                       view.nbytes, view.format, start, stop)
+            if view is not None:
+                chunk = view[start:stop]
+            else:
+                chunk = seq[start:stop]
+                if processes:
+                    # Not every sequence type can be pickled.
+                    chunk = list(chunk)
+            return executor.submit(_map_chunk, func, chunk)
+
+        try:
+            if getbuffer is not None:
+                view = memoryview(getbuffer(seq))
+                if processes:
+                    from multiprocessing.shared_memory import SharedMemory
+                    shm = SharedMemory(create=True, size=max(view.nbytes, 1))
+                    with view.cast('B') as raw:
+                        shm.buf[:view.nbytes] = raw
+            it = iter(starts)
+            for start in it:
+                pending[submit(start)] = start
+                if len(pending) >= window:
+                    break
+            while pending:
+                if ordered:
+                    future = next(iter(pending))
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    future = next(iter(done))
+                del pending[future]
+                for start in it:
+                    pending[submit(start)] = start
+                    break
+                yield from future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+            if own_executor:
+                executor.shutdown()
+            if view is not None:
+                view.release()
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    return results(executor)
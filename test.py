@@ -4,11 +4,22 @@
 # a few changes, but the goal is for the changes to be as small as
 # possible, so new stdlib test diffs can be pulled in easily.
 
+import array
+import copy
 from collections.abc import Sequence, MutableSequence, Mapping, MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+import operator
+import os
+import pickle
+import subprocess
 import sys
+import textwrap
 import unittest
+from unittest import mock
 
-from collectionhelpers import mapping_helper, sequence_helper
+import collectionhelpers
+from collectionhelpers import mapping_helper, sequence_helper, CopyOnWriteList
+from collectionhelpers import parallel_map, reset_key_filter
 
 @mapping_helper
 class FrozenKeyDict(Mapping):
@@ -76,6 +87,70 @@ class FrozenDictTest(unittest.TestCase):
         self.assertIn('a', d)
         self.assertNotIn('b', d)
 
+    def test_items(self):
+        d = self.type2test({'a': 'b', 'c': 'd'})
+        i = d.items()
+        self.assertEqual(sorted(i), [('a', 'b'), ('c', 'd')])
+        self.assertIn(('a', 'b'), i)
+        self.assertNotIn(('a', 'c'), i)
+        self.assertNotIn(('b', 'b'), i)
+        self.assertEqual(len(i), 2)
+
+    def test_values(self):
+        d = self.type2test({'a': 'b', 'c': 'd'})
+        v = d.values()
+        self.assertEqual(sorted(v), ['b', 'd'])
+        self.assertIn('b', v)
+        self.assertNotIn('a', v)
+
+    def test_eq(self):
+        d = self.type2test({'a': 'b', 'c': 'd'})
+        self.assertEqual(d, {'a': 'b', 'c': 'd'})
+        self.assertEqual(d, self.type2test({'c': 'd', 'a': 'b'}))
+        self.assertNotEqual(d, {'a': 'b'})
+        self.assertNotEqual(d, {'a': 'b', 'c': 'e'})
+        self.assertNotEqual(d, {'a': 'b', 'e': 'd'})
+        self.assertNotEqual(d, [('a', 'b'), ('c', 'd')])
+        # The other mapping's __missing__ must not make it look equal.
+        self.assertNotEqual(self.type2test({'a': 'a'}), self.type2test())
+        self.assertNotEqual(self.type2test(), self.type2test({'a': 'a'}))
+        nan = float('nan')
+        self.assertEqual(self.type2test({'a': nan}), {'a': nan})
+
+    def test_iter_items(self):
+        class BulkDict(self.type2test):
+            def _iter_items(self):
+                self.bulk = True
+                return iter(self._dict.items())
+        d = BulkDict({'a': 'b', 'c': 'd'})
+        d.bulk = False
+        self.assertEqual(sorted(d.values()), ['b', 'd'])
+        self.assertTrue(d.bulk)
+        d.bulk = False
+        self.assertEqual(sorted(d.items()), [('a', 'b'), ('c', 'd')])
+        self.assertTrue(d.bulk)
+        d.bulk = False
+        self.assertEqual(d, {'a': 'b', 'c': 'd'})
+        self.assertTrue(d.bulk)
+
+    def test_subclass_getitem(self):
+        class Sub(self.type2test):
+            def __getitem__(self, key):
+                return self._dict[key] * 2
+        @mapping_helper
+        class HelpedSub(Sub):
+            pass
+        for type2test in Sub, HelpedSub:
+            d = type2test({'a': 1})
+            self.assertEqual(d['a'], 2)
+            self.assertEqual(dict(d.items()), {'a': 2})
+            self.assertEqual(list(d.values()), [2])
+            self.assertIn(('a', 2), d.items())
+            self.assertNotIn(('a', 1), d.items())
+            self.assertNotIn(('b', 'b'), d.items())
+            self.assertEqual(d, {'a': 2})
+            self.assertNotEqual(d, {'a': 1})
+
     def test_getitem_immutable(self):
         d = self.type2test({'a': 'b'})
         self.assertEqual(d['a'], 'b')
@@ -147,6 +222,156 @@ class DictTest(FrozenDictTest):
         del d['a']
         self.assertEqual(d['a'], 'a')
     
+class CountingDict(dict):
+    lookups = 0
+    def __getitem__(self, key):
+        self.lookups += 1
+        return super().__getitem__(key)
+
+class CountingKeyDict(KeyDict):
+    def __new__(cls, *args, **kwargs):
+        self = super(CountingKeyDict, cls).__new__(cls)
+        self._dict = CountingDict(*args, **kwargs)
+        return self
+
+@mapping_helper(key_filter_error_rate=0.01)
+class FilteredKeyDict(CountingKeyDict):
+    pass
+
+class FilteredDictTest(DictTest):
+    type2test = FilteredKeyDict
+
+    def test_decorate_filtered(self):
+        self.assertRaises(ValueError, mapping_helper(key_filter_error_rate=0),
+                          KeyDict)
+        self.assertRaises(TypeError, mapping_helper(key_filter_error_rate=.1),
+                          List)
+        self.assertRaises(ValueError, mapping_helper(key_filter_error_rate=.1,
+                                                     key_filter_headroom=.5),
+                          KeyDict)
+
+    def test_filter_headroom(self):
+        @mapping_helper(key_filter_error_rate=0.01, key_filter_headroom=4)
+        class RoomyKeyDict(CountingKeyDict):
+            pass
+        d = self.type2test((i, i) for i in range(1000))
+        e = RoomyKeyDict((i, i) for i in range(1000))
+        self.assertNotIn(-1, d)
+        self.assertNotIn(-1, e)
+        dfilter = collectionhelpers._key_filters[id(d)]
+        efilter = collectionhelpers._key_filters[id(e)]
+        self.assertEqual(dfilter.capacity, 2000)
+        self.assertEqual(efilter.capacity, 4000)
+        self.assertGreater(len(efilter.bits), len(dfilter.bits))
+
+    def test_filter(self):
+        for type2test, filtered in (CountingKeyDict, False), (self.type2test, True):
+            d = type2test((i, i) for i in range(1000))
+            self.assertIn(0, d)
+            probes = {'__getitem__': (d.__getitem__, lambda i: i),
+                      '__contains__': (d.__contains__, lambda i: False),
+                      'get': (d.get, lambda i: None)}
+            for name, (probe, expected) in probes.items():
+                d._dict.lookups = 0
+                for i in range(1000, 2000):
+                    self.assertEqual(probe(i), expected(i))
+                if filtered:
+                    # Almost all of those should have skipped the lookup.
+                    self.assertLess(d._dict.lookups, 1000 * 0.05, name)
+                else:
+                    self.assertEqual(d._dict.lookups, 1000, name)
+        d = self.type2test((i, i) for i in range(1000))
+        for i in range(1000, 5000):
+            d[i] = -i
+        for i in range(0, 5000, 2):
+            del d[i]
+        for i in range(5000):
+            self.assertEqual(i in d, i % 2 == 1)
+            self.assertEqual(d.get(i), -i if i >= 1000 and i % 2 else
+                                       i if i % 2 else None)
+
+    def test_filter_not_copied(self):
+        d = self.type2test(('k%d' % i, i) for i in range(100))
+        self.assertNotIn('x', d)
+        self.assertNotIn('_key_filter', vars(d))
+        for c in copy.copy(d), copy.deepcopy(d), pickle.loads(pickle.dumps(d)):
+            c['x'] = 'x'
+            self.assertIn('x', c)
+            self.assertNotIn('x', d)
+            self.assertEqual(c.get('k5'), 5)
+
+    def test_filter_pickle_across_processes(self):
+        # str hashes are salted differently in each interpreter, so a
+        # pickled filter would be garbage in another one.
+        dump = textwrap.dedent("""
+            import pickle, sys
+            from test import FilteredKeyDict
+            d = FilteredKeyDict(('k%d' % i, i) for i in range(100))
+            assert 'x' not in d
+            sys.stdout.buffer.write(pickle.dumps(d))
+            """)
+        load = textwrap.dedent("""
+            import copy, pickle, sys
+            d = pickle.loads(sys.stdin.buffer.read())
+            for m in d, copy.deepcopy(d):
+                assert all('k%d' % i in m for i in range(100))
+                assert m.get('k5') == 5 and m['k5'] == 5
+                assert 'x' not in m
+            """)
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        def run(seed, script, input=None):
+            env = dict(os.environ, PYTHONHASHSEED=str(seed))
+            result = subprocess.run([sys.executable, '-c', script], cwd=cwd,
+                                    env=env, input=input, capture_output=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+            return result.stdout
+        run(2, load, input=run(1, dump))
+
+    def test_reset_key_filter(self):
+        d = self.type2test({'a': 1})
+        self.assertNotIn('b', d)
+        d._dict['b'] = 2
+        reset_key_filter(d)
+        self.assertIn('b', d)
+
+    def test_filter_weakref(self):
+        class Slotted(MutableMapping):
+            __slots__ = ('_dict',)
+            __getitem__ = __setitem__ = __delitem__ = 42
+            __iter__ = __len__ = 42
+        self.assertRaises(TypeError, mapping_helper(key_filter_error_rate=.1),
+                          Slotted)
+
+    def test_normalize_key(self):
+        @mapping_helper(key_filter_error_rate=0.01)
+        class CaseInsensitiveDict(MutableMapping):
+            def __init__(self, *args, **kwargs):
+                self._dict = dict(*args, **kwargs)
+            def __getitem__(self, key):
+                return self._dict[key.lower()]
+            def __setitem__(self, key, value):
+                self._dict[key.lower()] = value
+            def __delitem__(self, key):
+                del self._dict[key.lower()]
+            def __iter__(self):
+                return iter(self._dict)
+            def __len__(self):
+                return len(self._dict)
+            def __missing__(self, key):
+                return key
+            def _normalize_key(self, key):
+                return key.lower()
+        d = CaseInsensitiveDict({'accept': 'a'})
+        d['Content-Type'] = 'x'
+        for key in 'Accept', 'ACCEPT', 'accept':
+            self.assertIn(key, d)
+            self.assertEqual(d.get(key), 'a')
+            self.assertEqual(d[key], 'a')
+        self.assertIn('Content-Type', d)
+        self.assertEqual(d.get('CONTENT-TYPE'), 'x')
+        self.assertNotIn('Host', d)
+        self.assertEqual(d['Host'], 'Host')
+
 @sequence_helper
 class Tuple(Sequence):
     def __new__(cls, *args, **kwargs):
@@ -507,6 +732,14 @@ class ListTest(TupleTest):
         del a[:]
         self.assertEqual(a, self.type2test([]))
 
+    def test_delslice_negative_step(self):
+        a = self.type2test(range(10))
+        del a[::-3]
+        self.assertEqual(a, self.type2test([1, 2, 4, 5, 7, 8]))
+        a = self.type2test(range(5))
+        del a[::-1]
+        self.assertEqual(a, self.type2test([]))
+
     def test_insert(self):
         a = self.type2test([0, 1, 2])
         a.insert(0, -2)
@@ -580,6 +813,286 @@ class ListTest(TupleTest):
         # test issue7788
         a = self.type2test(range(10))
         del a[9::1<<333]
-        
+
+@sequence_helper(batching=True)
+class BatchingList(List):
+    pass
+
+class BulkList(BatchingList):
+    def __new__(cls, *args, **kwargs):
+        self = super(BulkList, cls).__new__(cls, *args, **kwargs)
+        self.log = []
+        return self
+    def _delete_range(self, start, stop):
+        assert 0 <= start <= stop <= len(self)
+        self.log.append(('del', start, stop))
+        del self._list[start:stop]
+    def _insert_many(self, index, values):
+        assert 0 <= index <= len(self)
+        self.log.append(('ins', index, list(values)))
+        self._list[index:index] = values
+    def _set_many(self, index, values):
+        assert 0 <= index <= index + len(values) <= len(self)
+        self.log.append(('set', index, list(values)))
+        self._list[index:index+len(values)] = values
+
+class BatchTest(unittest.TestCase):
+    def test_decorate(self):
+        self.assertFalse(hasattr(List, 'batch'))
+        self.assertTrue(hasattr(BatchingList, 'batch'))
+        self.assertRaises(TypeError, sequence_helper(batching=True), Tuple)
+
+    def test_batch(self):
+        for type2test in BatchingList, BulkList:
+            l = list(range(10))
+            a = type2test(l)
+            with a.batch():
+                del a[2:6]
+                del l[2:6]
+                a[1:1] = 'xyz'
+                l[1:1] = 'xyz'
+                a.extend([10, 11])
+                l.extend([10, 11])
+                a[::3] = 'abcd'
+                l[::3] = 'abcd'
+            self.assertEqual(list(a), l)
+
+    def test_coalesce(self):
+        a = BulkList(range(10))
+        with a.batch():
+            del a[2:6]
+            a[1:1] = 'xyz'
+            a.extend([10, 11])
+            a[0] = 'a'
+            a[1] = 'b'
+            self.assertEqual(a.log, [])
+        self.assertEqual(a.log, [('del', 2, 6), ('ins', 1, ['x', 'y', 'z']),
+                                 ('ins', 9, [10, 11]), ('set', 0, ['a', 'b'])])
+        self.assertEqual(list(a), ['a', 'b', 'y', 'z', 1, 6, 7, 8, 9, 10, 11])
+
+    def test_read_your_writes(self):
+        a = BulkList(range(5))
+        with a.batch():
+            a.append(5)
+            self.assertEqual(len(a), 6)
+            self.assertEqual(a.log, [])
+            self.assertEqual(a[-1], 5)
+            self.assertEqual(a.log, [('ins', 5, [5])])
+            del a[0]
+            self.assertEqual(len(a), 5)
+            self.assertEqual(list(a), [1, 2, 3, 4, 5])
+        self.assertEqual(a.log, [('ins', 5, [5]), ('del', 0, 1)])
+
+    def test_batch_subclass(self):
+        @sequence_helper
+        class SubList(BatchingList):
+            pass
+
+        @sequence_helper
+        class SuperLenList(BatchingList):
+            def __len__(self):
+                return super().__len__()
+
+        for type2test in SubList, SuperLenList:
+            a = type2test(range(5))
+            with a.batch():
+                a.append(5)
+                self.assertEqual(len(a), 6)
+                a.append(6)
+                self.assertEqual(len(a), 7)
+                self.assertEqual(a[5], 5)
+                a.insert(7, 7)
+                del a[0]
+                self.assertEqual(len(a), 7)
+            self.assertEqual(list(a), [1, 2, 3, 4, 5, 6, 7])
+
+    def test_batch_existing(self):
+        @sequence_helper(batching=True)
+        class BatchList(List):
+            batch = 42
+        self.assertEqual(BatchList.batch, 42)
+
+        @sequence_helper
+        class InsertList(BatchingList):
+            def insert(self, index, value):
+                assert 0 <= index <= len(self)
+                self._list.insert(index, value * 10)
+        a = InsertList(range(3))
+        with a.batch():
+            a.extend([3, 4])
+        self.assertEqual(list(a), [0, 1, 2, 30, 40])
+
+    def test_batch_exception(self):
+        a = BulkList(range(5))
+        with self.assertRaises(IndexError):
+            with a.batch():
+                del a[0]
+                del a[10]
+        self.assertEqual(list(a), [1, 2, 3, 4])
+        a.append(5)
+        self.assertEqual(a.log, [('del', 0, 1)])
+
+class SmallCopyOnWriteList(CopyOnWriteList):
+    chunk_size = 2
+
+class CopyOnWriteListTest(ListTest):
+    type2test = SmallCopyOnWriteList
+
+    def test_copy(self):
+        a = self.type2test(range(10))
+        b = a.copy()
+        self.assertEqual(a, b)
+        self.assertIsNot(a, b)
+        b.append(10)
+        self.assertEqual(a, list(range(10)))
+
+    def test_eq(self):
+        a = self.type2test(range(10))
+        self.assertTrue(a == a.copy())
+        self.assertTrue(a == a[:])
+        self.assertTrue(a == list(range(10)))
+        self.assertTrue(list(range(10)) == a)
+        self.assertTrue(a == CopyOnWriteList(range(10)))
+        self.assertFalse(a != list(range(10)))
+        self.assertTrue(a != list(range(9)))
+        self.assertTrue(a != list(range(1, 11)))
+        self.assertTrue(a != tuple(range(10)))
+        b = a.copy()
+        b[5] = 'x'
+        self.assertTrue(a != b)
+        self.assertRaises(TypeError, hash, a)
+
+    def test_share(self):
+        l = list(range(20))
+        a = self.type2test(l)
+        b = a[3:15]
+        c = b[:]
+        # Chunks wholly inside the slice are shared, not copied.
+        self.assertIs(a._chunks[2], b._chunks[1])
+        self.assertIs(b._chunks[1], c._chunks[1])
+        a[4] = 'a'
+        l[4] = 'a'
+        del a[9]
+        del l[9]
+        b[1] = 'b'
+        b.insert(6, 'b')
+        c[2:4] = 'cccc'
+        self.assertEqual(a, l)
+        self.assertEqual(b, [3, 'b', 5, 6, 7, 8, 'b', 9, 10, 11, 12, 13, 14])
+        self.assertEqual(c, [3, 4, 'c', 'c', 'c', 'c', 7, 8, 9, 10, 11, 12,
+                             13, 14])
+        # Only the chunks that were mutated got copied.
+        self.assertIs(a._chunks[6], b._chunks[5])
+        self.assertIs(b._chunks[5], c._chunks[-2])
+
+def neg_unless_five(x):
+    if x == 5:
+        raise ValueError(x)
+    return -x
+
+@sequence_helper
+class DoubleArray(Sequence):
+    def __init__(self, iterable=()):
+        self._array = array.array('d', iterable)
+    def __getitem__(self, index):
+        assert isinstance(index, int)
+        assert 0 <= index < len(self)
+        return self._array[index]
+    def __len__(self):
+        return len(self._array)
+    def _buffer(self):
+        return self._array
+
+class ParallelMapTest(unittest.TestCase):
+    def check(self, seq, **kwargs):
+        expected = [-x for x in seq]
+        self.assertEqual(list(parallel_map(operator.neg, seq, **kwargs)),
+                         expected)
+        self.assertEqual(sorted(parallel_map(operator.neg, seq, ordered=False,
+                                             **kwargs)),
+                         sorted(expected))
+
+    def test_threads(self):
+        for type2test in Tuple, List, SmallCopyOnWriteList, DoubleArray:
+            for n in 0, 1, 100:
+                seq = type2test(range(n))
+                self.check(seq)
+                self.check(seq, chunk_size=1)
+                self.check(seq, chunk_size=7)
+                self.check(seq, chunk_size=1000)
+        self.assertRaises(ValueError, parallel_map, abs, List(), chunk_size=0)
+
+    def test_processes(self):
+        with ProcessPoolExecutor(2) as executor:
+            for type2test in List, DoubleArray:
+                self.check(type2test(range(100)), chunk_size=7,
+                           executor=executor)
+
+    def test_processes_raise(self):
+        with ProcessPoolExecutor(2) as executor:
+            for type2test in List, DoubleArray:
+                results = parallel_map(neg_unless_five, type2test(range(10)),
+                                       chunk_size=3, executor=executor)
+                with self.assertRaises(ValueError):
+                    list(results)
+
+    @unittest.skipIf(sys.version_info >= (3, 13) or os.name == 'nt',
+                     "only POSIX before 3.13 maps shared memory itself")
+    def test_attach_without_posixshmem(self):
+        from multiprocessing.shared_memory import SharedMemory
+        shm = SharedMemory(create=True, size=16)
+        try:
+            shm.buf[:4] = b'spam'
+            with mock.patch.dict(sys.modules, {'_posixshmem': None}), \
+                 mock.patch('multiprocessing.resource_tracker.unregister') \
+                 as unregister:
+                attached = collectionhelpers._attached_shared_memory(shm.name, 4)
+                with attached as buf:
+                    self.assertEqual(bytes(buf), b'spam')
+            unregister.assert_called_once_with(shm._name, 'shared_memory')
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def test_processes_shared_memory(self):
+        # Shared memory problems (like a worker's resource tracker
+        # unlinking the segment) only show up as warnings from the
+        # tracker process at exit, so run this in its own interpreter.
+        # The workers are started before any shared memory exists, so
+        # they get their own trackers, and then again after, with the
+        # parent's tracker, with each start method.
+        script = textwrap.dedent("""
+            from concurrent.futures import ProcessPoolExecutor
+            import multiprocessing
+            import operator
+            from collectionhelpers import parallel_map, reset_key_filter
+            from test import DoubleArray, List
+            if __name__ == '__main__':
+                for method in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context(method)
+                    for early in True, False:
+                        with ProcessPoolExecutor(2, context) as executor:
+                            if early:
+                                list(parallel_map(operator.neg, List(range(10)),
+                                                  executor=executor))
+                            for _ in range(3):
+                                results = parallel_map(operator.neg,
+                                                       DoubleArray(range(100)),
+                                                       chunk_size=7,
+                                                       executor=executor)
+                                assert list(results) == [-x for x in range(100)]
+            """)
+        result = subprocess.run([sys.executable, '-W', 'error', '-c', script],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stderr, '')
+
+    def test_close(self):
+        results = parallel_map(operator.neg, DoubleArray(range(100)),
+                               chunk_size=1)
+        self.assertEqual(next(results), 0)
+        results.close()
+
 if __name__ == '__main__':
     unittest.main()